@@ -1,16 +1,29 @@
 import streamlit as st
 import pandas as pd
 from io import BytesIO
+import hashlib
 import json
+import os
+from google.api_core.exceptions import GoogleAPICallError
 from ocr_utils import (
     vision_client_from_service_account_info,
     ocr_bytes,
+    prepare_lines,
     extract_summary_fields,
     extract_line_items,
 )
 
 st.set_page_config(page_title="Invoice OCR → Excel", layout="wide")
 
+# (label, key) for each summary field; drives both the metric cards and the
+# Summary sheet so the two can't drift apart.
+SUMMARY_FIELDS = (
+    ("Vendor", "vendor"),
+    ("Invoice #", "invoice_number"),
+    ("Date", "invoice_date"),
+    ("Total", "total"),
+)
+
 # --- Jazzy header ---
 st.markdown(
     """
@@ -51,6 +64,26 @@ else:
 
 st.write("")  # spacing
 
+
+# --- Caching: identical uploads skip Vision entirely ---
+# Keyed on the file's SHA-256 and extension; the leading underscore keeps
+# the raw bytes and the client out of Streamlit's own argument hashing.
+# ocr_bytes raises when Vision fails a page, and st.cache_data doesn't cache
+# exceptions, so only complete results are stored.
+OCR_CACHE_TTL = 3600  # seconds
+
+
+@st.cache_data(show_spinner=False, max_entries=128, ttl=OCR_CACHE_TTL)
+def cached_ocr(file_sha256, suffix, _file_bytes, _client):
+    return ocr_bytes(_file_bytes, suffix, _client)
+
+
+@st.cache_data(show_spinner=False, max_entries=128)
+def cached_extract(text):
+    lines = prepare_lines(text)
+    return extract_summary_fields(text, lines=lines), extract_line_items(text, lines=lines)
+
+
 # --- Upload UI ---
 with st.container():
     col1, col2 = st.columns([1, 2])
@@ -75,23 +108,26 @@ if uploaded is not None:
         st.error("OCR disabled — please add Google Cloud Vision credentials to Streamlit secrets (GCP_CREDENTIALS_JSON).")
     else:
         with st.spinner("Running OCR via Google Vision..."):
-            file_bytes = uploaded.read()
-            text = ocr_bytes(file_bytes, uploaded.name, vision_client)
+            # zero-copy view over Streamlit's upload buffer; hashed in place
+            file_bytes = uploaded.getbuffer()
+            file_sha256 = hashlib.sha256(file_bytes).hexdigest()
+            suffix = os.path.splitext(uploaded.name)[1].lower()
+            try:
+                text = cached_ocr(file_sha256, suffix, file_bytes, vision_client)
+            except GoogleAPICallError as e:
+                st.error(f"Google Vision could not OCR this file: {e}")
+                st.stop()
 
         st.markdown("### OCR Preview")
         st.code(text[:10000], language=None)
 
         st.markdown("### Extracted Summary")
-        summary = extract_summary_fields(text)
+        summary, items = cached_extract(text)
         # present summary as metrics/cards
-        s_col1, s_col2, s_col3, s_col4 = st.columns(4)
-        s_col1.metric("Vendor", summary.get("vendor", "") or "—")
-        s_col2.metric("Invoice #", summary.get("invoice_number", "") or "—")
-        s_col3.metric("Date", summary.get("invoice_date", "") or "—")
-        s_col4.metric("Total", summary.get("total", "") or "—")
+        for s_col, (label, key) in zip(st.columns(len(SUMMARY_FIELDS)), SUMMARY_FIELDS):
+            s_col.metric(label, summary.get(key, "") or "—")
 
         st.markdown("### Line Items (naive)")
-        items = extract_line_items(text)
         if items:
             items_df = pd.DataFrame(items)
             st.dataframe(items_df, use_container_width=True)
@@ -101,8 +137,12 @@ if uploaded is not None:
         # Prepare Excel
         def create_excel_bytes(summary_d, items_list):
             output = BytesIO()
-            with pd.ExcelWriter(output, engine="openpyxl") as writer:
-                pd.DataFrame.from_records([summary_d]).to_excel(writer, index=False, sheet_name="Summary")
+            with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
+                summary_df = pd.DataFrame({
+                    "Field": [label for label, _ in SUMMARY_FIELDS],
+                    "Value": [summary_d.get(key, "") for _, key in SUMMARY_FIELDS],
+                })
+                summary_df.to_excel(writer, index=False, sheet_name="Summary")
                 if items_list:
                     pd.DataFrame(items_list).to_excel(writer, index=False, sheet_name="LineItems")
             return output.getvalue()
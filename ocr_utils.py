@@ -1,19 +1,83 @@
 import io
-import json
+import multiprocessing
+import os
 import re
-from typing import List, Dict
-from PIL import Image
-import numpy as np
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from itertools import repeat
+from typing import List, Dict, Optional, Union
+from PIL import Image, ImageOps
 
 # PyMuPDF as fitz for rendering PDFs to images
 import fitz  # PyMuPDF
 
 # Google Vision
+from google.api_core import exceptions as gexc
 from google.cloud import vision
 from google.oauth2 import service_account
+from tenacity import Retrying, retry_if_exception_type, stop_after_attempt, wait_exponential
 
 # ---- OCR helpers ----
 
+# Uploads may arrive as a memoryview over Streamlit's buffer; helpers accept any
+# of these and only copy to bytes where a library insists on it.
+BytesLike = Union[bytes, bytearray, memoryview]
+
+_JPEG_QUALITY = 85
+# PDF pages render at ~200 dpi (zoom is relative to PDF's 72 dpi user space)
+_TARGET_DPI = 200
+_MIN_ZOOM = 1.0
+_MAX_ZOOM = 3.0
+# A page with more embedded text than this is treated as born-digital and not OCR'd
+_MIN_EMBEDDED_TEXT_CHARS = 50
+# Render workers must not fork the threaded Streamlit server (Tornado, gRPC and
+# the Vision thread pools are live); use forkserver where available, else spawn.
+_RENDER_MP_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+# Fewer pages than this render in-process; a handful of pages isn't worth
+# shipping the PDF to worker processes.
+_POOL_RENDER_MIN_PAGES = 8
+
+# Vision calls are I/O bound, so page batches are OCR'd concurrently. Keep the fan-out
+# and request rate modest so a single upload doesn't trip project quotas.
+_VISION_MAX_WORKERS = 8
+_VISION_MAX_RPS = 10.0
+# Maximum number of images Vision accepts in one batch_annotate_images call.
+_VISION_BATCH_SIZE = 16
+# Inline batch_annotate_files handles at most 5 pages per request; PDFs larger
+# than the inline payload limit are rendered locally and sent as images instead.
+_VISION_FILE_PAGE_LIMIT = 5
+_VISION_INLINE_PDF_LIMIT = 20 * 1024 * 1024
+
+
+class _RateLimiter:
+    """
+    Minimal thread-safe limiter spacing calls at least 1/rate seconds apart.
+    """
+
+    def __init__(self, rate: float):
+        self._interval = 1.0 / rate
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self._interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+_vision_semaphore = threading.BoundedSemaphore(_VISION_MAX_WORKERS)
+_vision_rate_limiter = _RateLimiter(_VISION_MAX_RPS)
+
 def vision_client_from_service_account_info(sa_info: dict):
     """
     Create a google.cloud.vision.ImageAnnotatorClient from service account info dict.
@@ -23,44 +87,212 @@ def vision_client_from_service_account_info(sa_info: dict):
     return client
 
 
-def pdf_to_images_via_fitz(pdf_bytes: bytes, zoom: float = 2.0) -> List[bytes]:
+def _page_zoom(page, target_dpi: int) -> float:
     """
-    Convert PDF bytes to list of PNG bytes using PyMuPDF (fitz).
-    zoom controls resolution (2.0 => ~150-200 dpi depending on source)
+    Pick a render zoom for one page: target_dpi, but never above the native
+    resolution of a scan covering the page (upsampling only adds pixels for
+    Vision to chew through). Clamped to [_MIN_ZOOM, _MAX_ZOOM].
     """
-    imgs = []
-    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    dpi = float(target_dpi)
+    page_area = abs(page.rect)
+    # the largest embedded image is the scan, if this is a scanned page
+    images = [info for info in page.get_image_info() if not fitz.Rect(info["bbox"]).is_empty]
+    if images and page_area:
+        scan = max(images, key=lambda info: abs(fitz.Rect(info["bbox"])))
+        bbox = fitz.Rect(scan["bbox"])
+        if abs(bbox) >= 0.5 * page_area:
+            source_dpi = max(scan["width"], scan["height"]) * 72.0 / max(bbox.width, bbox.height)
+            dpi = min(dpi, source_dpi)
+    return min(max(dpi / 72.0, _MIN_ZOOM), _MAX_ZOOM)
+
+
+def _pixmap_to_jpeg(pix) -> bytes:
+    """
+    Encode a fitz Pixmap as JPEG with Pillow, whose libjpeg-turbo encoder is
+    several times faster than MuPDF's own. JPEG at q85 is far smaller than PNG
+    and still clean for text OCR.
+    """
+    mode = "L" if pix.n == 1 else "RGB"
+    img = Image.frombytes(mode, (pix.width, pix.height), pix.samples, "raw", mode, pix.stride)
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=_JPEG_QUALITY, optimize=False)
+    return out.getvalue()
+
+
+def _render_doc_page(doc, page_index: int, target_dpi: int, grayscale: bool) -> bytes:
+    """
+    Render one page of an open fitz document to JPEG bytes.
+    """
+    page = doc[page_index]
+    zoom = _page_zoom(page, target_dpi)
     mat = fitz.Matrix(zoom, zoom)
+    colorspace = fitz.csGRAY if grayscale else fitz.csRGB
+    pix = page.get_pixmap(matrix=mat, colorspace=colorspace, alpha=False)
+    return _pixmap_to_jpeg(pix)
+
+
+# The render pool outlives a single upload: workers pay for interpreter start
+# and this module's imports once. Each worker keeps the PDF it is rendering
+# open between pages, keyed by the temp file path.
+_render_pool = None
+_render_pool_lock = threading.Lock()
+_worker_doc = None  # (path, fitz document), only set inside worker processes
+
+
+def _get_render_pool() -> ProcessPoolExecutor:
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=_RENDER_MP_CONTEXT)
+        return _render_pool
+
+
+def _discard_render_pool(pool: ProcessPoolExecutor):
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is pool:
+            _render_pool = None
+    pool.shutdown(wait=False)
+
+
+def _render_file_page(path: str, page_index: int, target_dpi: int, grayscale: bool) -> bytes:
+    """
+    Worker-side render: open the PDF at path on first use and reuse it for
+    the rest of that job's pages.
+    """
+    global _worker_doc
+    if _worker_doc is None or _worker_doc[0] != path:
+        if _worker_doc is not None:
+            _worker_doc[1].close()
+        _worker_doc = (path, fitz.open(path))
+    return _render_doc_page(_worker_doc[1], page_index, target_dpi, grayscale)
+
+
+def render_pdf_pages(
+    pdf_bytes: BytesLike, page_indices: List[int], target_dpi: int = _TARGET_DPI, grayscale: bool = True
+) -> List[bytes]:
+    """
+    Render the given PDF pages (0-based) to JPEG bytes, in order.
+    Small jobs render in-process; larger ones are spread over the shared
+    process pool, which reads the PDF from a temp file instead of receiving a
+    pickled copy per page.
+    """
+    if len(page_indices) >= _POOL_RENDER_MIN_PAGES and (os.cpu_count() or 1) > 1:
+        # unique name, so a worker never mistakes this job for an earlier one
+        path = os.path.join(tempfile.gettempdir(), "intellidocex-%s.pdf" % uuid.uuid4().hex)
+        with open(path, "xb") as f:
+            f.write(pdf_bytes)
+        pool = _get_render_pool()
+        try:
+            return list(pool.map(_render_file_page, repeat(path), page_indices, repeat(target_dpi), repeat(grayscale)))
+        except BrokenProcessPool:
+            # a worker died (e.g. OOM-killed); start a fresh pool next time
+            # and finish this job in-process
+            _discard_render_pool(pool)
+        finally:
+            os.remove(path)
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        return [_render_doc_page(doc, i, target_dpi, grayscale) for i in page_indices]
+    finally:
+        doc.close()
+
+
+def pdf_extract_or_render(
+    pdf_bytes: BytesLike, target_dpi: int = _TARGET_DPI, grayscale: bool = True, render: bool = True
+) -> List[Union[str, bytes, None]]:
+    """
+    Prepare each PDF page for text extraction using PyMuPDF (fitz).
+    Born-digital pages that carry an embedded text layer are returned as that
+    text (str) and need no OCR. Remaining (scanned) pages are rendered to
+    JPEG bytes for Vision, or left as None when render is False.
+    target_dpi is the render resolution; scanned pages are capped at the
+    resolution of the embedded scan (see _page_zoom).
+    grayscale renders single-channel pages, roughly halving the upload size;
+    OCR accuracy on invoices is unaffected.
+    Pages are rendered with render_pdf_pages.
+    """
+    pages: List[Union[str, bytes, None]] = []
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
     for page in doc:
-        pix = page.get_pixmap(matrix=mat, alpha=False)
-        img_bytes = pix.tobytes("png")
-        imgs.append(img_bytes)
+        text = page.get_text("text")
+        pages.append(text if len(text.strip()) > _MIN_EMBEDDED_TEXT_CHARS else None)
     doc.close()
-    return imgs
+
+    if not render:
+        return pages
+
+    to_render = [i for i, p in enumerate(pages) if p is None]
+    rendered = render_pdf_pages(pdf_bytes, to_render, target_dpi, grayscale)
+    for i, img_bytes in zip(to_render, rendered):
+        pages[i] = img_bytes
+    return pages
 
 
-def load_image_bytes(image_bytes: bytes) -> bytes:
+def _pdf_subset(pdf_bytes: BytesLike, page_indices: List[int]) -> bytes:
+    """
+    Build a PDF containing only the given pages (0-based), without rendering.
+    This is where an upload view is first copied into bytes for Vision.
+    """
+    src = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        if page_indices == list(range(src.page_count)):
+            return bytes(pdf_bytes)
+        sub = fitz.open()
+        for i in page_indices:
+            sub.insert_pdf(src, from_page=i, to_page=i)
+        out = sub.tobytes()
+        sub.close()
+        return out
+    finally:
+        src.close()
+
+
+# Longest image edge sent to Vision; phone photos are downscaled to this.
+_MAX_IMAGE_EDGE = 2500
+
+_PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
+_JPEG_MAGIC = b"\xff\xd8\xff"
+
+
+def load_image_bytes(image_bytes: BytesLike) -> bytes:
     """
     Ensure image is a PNG/JPEG bytes suitable for Vision.
-    If the uploaded bytes are already an image, we normalize them via PIL to PNG.
+    PNG and JPEG uploads within _MAX_IMAGE_EDGE are passed through untouched.
+    Larger images are downscaled (keeping their format), and anything else is
+    normalized via PIL to PNG.
     """
-    img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+    # Vision's protobuf wants real bytes; this is the only copy of the upload
+    data = bytes(image_bytes)
+    # sniff by signature rather than img.format: phone cameras write
+    # multi-picture JPEGs that Pillow reports as "MPO" but Vision reads as JPEG
+    if data.startswith(_JPEG_MAGIC):
+        fmt = "JPEG"
+    elif data.startswith(_PNG_MAGIC):
+        fmt = "PNG"
+    else:
+        fmt = None
+    img = Image.open(io.BytesIO(data))  # lazy: only the header is parsed here
+    if fmt and max(img.size) <= _MAX_IMAGE_EDGE:
+        return data
+    if fmt == "JPEG":
+        # let libjpeg decode at reduced scale instead of full resolution
+        img.draft("RGB", (_MAX_IMAGE_EDGE, _MAX_IMAGE_EDGE))
+    # bake in EXIF rotation, which is lost on re-encode
+    img = ImageOps.exif_transpose(img).convert("RGB")
+    img.thumbnail((_MAX_IMAGE_EDGE, _MAX_IMAGE_EDGE), Image.Resampling.LANCZOS)
     out = io.BytesIO()
-    img.save(out, format="PNG")
+    if fmt == "JPEG":
+        img.save(out, format="JPEG", quality=_JPEG_QUALITY)
+    else:
+        img.save(out, format="PNG")
     return out.getvalue()
 
 
-def ocr_image_with_vision_bytes(img_bytes: bytes, client: vision.ImageAnnotatorClient) -> str:
+def _response_text(response) -> str:
     """
-    Use Google Vision Document/Text detection on image bytes.
-    Returns extracted full text.
+    Pull the full text out of a Vision AnnotateImageResponse.
     """
-    image = vision.Image(content=img_bytes)
-    # Use document_text_detection for better layout and full text
-    response = client.document_text_detection(image=image)
-    if response.error.message:
-        # fallback to text_detection if any error
-        response = client.text_detection(image=image)
     # Try full_text_annotation when available
     text = ""
     if hasattr(response, "full_text_annotation") and response.full_text_annotation:
@@ -73,16 +305,189 @@ def ocr_image_with_vision_bytes(img_bytes: bytes, client: vision.ImageAnnotatorC
     return text or ""
 
 
-def ocr_bytes(file_bytes: bytes, filename: str, vision_client: vision.ImageAnnotatorClient) -> str:
+# Transient Vision failures (quota, overload, timeouts) are retried with
+# exponential backoff; anything else surfaces immediately. This is the only
+# retry layer: the generated client's own retry (up to 600 s) is disabled with
+# retry=None, every call gets an explicit timeout, and every attempt goes
+# through _vision_rate_limiter.
+_VISION_TIMEOUT = 60.0
+_VISION_ATTEMPTS = 3
+_RETRYABLE_VISION_ERRORS = (gexc.ResourceExhausted, gexc.DeadlineExceeded, gexc.ServiceUnavailable)
+# google.rpc status codes (DEADLINE_EXCEEDED, RESOURCE_EXHAUSTED, UNAVAILABLE)
+# carried in per-image response.error
+_RETRYABLE_STATUS_CODES = frozenset({4, 8, 14})
+_vision_retry_wait = wait_exponential(min=1, max=30)
+
+
+def _vision_retrying() -> Retrying:
+    return Retrying(
+        retry=retry_if_exception_type(_RETRYABLE_VISION_ERRORS),
+        wait=_vision_retry_wait,
+        stop=stop_after_attempt(_VISION_ATTEMPTS),
+        reraise=True,
+    )
+
+
+def _annotate_with_retries(call, requests: list) -> list:
+    """
+    Send requests via call (client.batch_annotate_images or
+    client.batch_annotate_files) and return one response per request, in order.
+    Vision reports per-item failures in response.error rather than raising;
+    only the items that failed with a transient code are re-sent, so one
+    throttled page doesn't re-spend quota on the whole batch. If transient
+    failures outlast the retries, the matching api_core exception
+    (ResourceExhausted, ServiceUnavailable, ...) is raised. Responses with
+    non-transient errors are returned for the caller to handle.
+    """
+    responses = [None] * len(requests)
+    pending = list(range(len(requests)))
+    for attempt in _vision_retrying():
+        with attempt:
+            _vision_rate_limiter.wait()
+            batch = call(requests=[requests[i] for i in pending], retry=None, timeout=_VISION_TIMEOUT)
+            failed = []
+            for i, response in zip(pending, batch.responses):
+                responses[i] = response
+                if response.error.code in _RETRYABLE_STATUS_CODES:
+                    failed.append(i)
+            pending = failed
+            if pending:
+                error = responses[pending[0]].error
+                raise gexc.from_grpc_status(error.code, error.message)
+    return responses
+
+
+def _text_detection_fallback(img_bytes: bytes, response, client: vision.ImageAnnotatorClient):
+    """
+    Last resort for an image document_text_detection rejected with a
+    non-transient error: plain text_detection. On failure the original
+    response is kept.
+    """
+    _vision_rate_limiter.wait()
+    try:
+        return client.text_detection(image=vision.Image(content=img_bytes), retry=None, timeout=_VISION_TIMEOUT)
+    except gexc.GoogleAPICallError:
+        return response
+
+
+def ocr_image_with_vision_bytes(img_bytes: bytes, client: vision.ImageAnnotatorClient) -> str:
+    """
+    Use Google Vision Document/Text detection on image bytes.
+    Returns extracted full text.
+    """
+    return ocr_images_with_vision_batch([img_bytes], client)[0]
+
+
+def ocr_images_with_vision_batch(img_bytes_list: List[bytes], client: vision.ImageAnnotatorClient) -> List[str]:
+    """
+    Run document text detection on several images with a single
+    batch_annotate_images call. Callers must keep the list within
+    _VISION_BATCH_SIZE images. Returns one text per image, in order.
+    Raises a google.api_core exception if any image can't be read.
+    """
+    feature = vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)
+    requests = [
+        vision.AnnotateImageRequest(image=vision.Image(content=b), features=[feature])
+        for b in img_bytes_list
+    ]
+    responses = _annotate_with_retries(client.batch_annotate_images, requests)
+    texts = []
+    for img_bytes, response in zip(img_bytes_list, responses):
+        if response.error.message:
+            # non-transient failure (transient ones raised above):
+            # fallback to plain text_detection for just this image
+            response = _text_detection_fallback(img_bytes, response, client)
+        if response.error.message:
+            # never hand back a silently empty page (app.py caches results)
+            raise gexc.from_grpc_status(response.error.code, response.error.message)
+        texts.append(_response_text(response))
+    return texts
+
+
+def ocr_pdf_with_vision(pdf_bytes: bytes, page_count: int, client: vision.ImageAnnotatorClient) -> List[Optional[str]]:
+    """
+    OCR a small PDF (at most _VISION_FILE_PAGE_LIMIT pages, see _pdf_subset)
+    by sending it to Vision (batch_annotate_files), so rasterization happens
+    server-side. Returns one text per page, in order, with None for pages
+    Vision couldn't process; the caller renders those locally. Makes no fitz
+    calls, so it is safe to run in worker threads.
+    """
+    feature = vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)
+    request = vision.AnnotateFileRequest(
+        input_config=vision.InputConfig(content=pdf_bytes, mime_type="application/pdf"),
+        features=[feature],
+        pages=list(range(1, page_count + 1)),
+    )
+    file_response = _annotate_with_retries(client.batch_annotate_files, [request])[0]
+    if file_response.error.message:
+        return [None] * page_count
+    texts = [None if r.error.message else _response_text(r) for r in file_response.responses]
+    return texts + [None] * (page_count - len(texts))
+
+
+def _ocr_pdf_throttled(pdf_bytes: bytes, page_count: int, client: vision.ImageAnnotatorClient) -> List[Optional[str]]:
+    """
+    OCR one page-subset PDF within the shared concurrency limit.
+    """
+    with _vision_semaphore:
+        return ocr_pdf_with_vision(pdf_bytes, page_count, client=client)
+
+
+def _ocr_batch_throttled(img_bytes_list: List[bytes], client: vision.ImageAnnotatorClient) -> List[str]:
+    """
+    OCR one batch of pages within the shared concurrency limit.
+    """
+    with _vision_semaphore:
+        return ocr_images_with_vision_batch(img_bytes_list, client=client)
+
+
+def _map_batches(fn, *iterables) -> list:
+    """
+    Call fn on each batch concurrently (Vision calls are I/O bound) and
+    flatten the per-batch results. map() keeps page order.
+    """
+    results = []
+    with ThreadPoolExecutor(max_workers=_VISION_MAX_WORKERS) as executor:
+        for batch_results in executor.map(fn, *iterables):
+            results.extend(batch_results)
+    return results
+
+
+def ocr_bytes(file_bytes: BytesLike, filename: str, vision_client: vision.ImageAnnotatorClient) -> str:
     """
     Take uploaded bytes and run OCR using Google Vision. Handles PDF and images.
     """
     lower = filename.lower()
     text_pages = []
     if lower.endswith(".pdf"):
-        images = pdf_to_images_via_fitz(file_bytes)
-        for img_bytes in images:
-            text_pages.append(ocr_image_with_vision_bytes(img_bytes, vision_client))
+        # only pages without an embedded text layer need OCR
+        if len(file_bytes) <= _VISION_INLINE_PDF_LIMIT:
+            # send the PDF pages themselves; Vision rasterizes them server-side
+            pages = pdf_extract_or_render(file_bytes, render=False)
+            ocr_indices = [i for i, p in enumerate(pages) if p is None]
+            size = _VISION_FILE_PAGE_LIMIT
+            chunks = [ocr_indices[i:i + size] for i in range(0, len(ocr_indices), size)]
+            # PyMuPDF isn't thread-safe: build every sub-PDF here so the
+            # worker threads only make RPCs
+            subsets = [_pdf_subset(file_bytes, chunk) for chunk in chunks]
+            ocr_pdf = partial(_ocr_pdf_throttled, client=vision_client)
+            for i, page_text in zip(ocr_indices, _map_batches(ocr_pdf, subsets, map(len, chunks))):
+                pages[i] = page_text
+            # pages Vision couldn't read from the PDF are rendered here and sent as images
+            failed = [i for i in ocr_indices if pages[i] is None]
+            for i, img_bytes in zip(failed, render_pdf_pages(file_bytes, failed)):
+                pages[i] = img_bytes
+        else:
+            # too large to send inline; render scanned pages locally and send images
+            pages = pdf_extract_or_render(file_bytes)
+        ocr_indices = [i for i, p in enumerate(pages) if isinstance(p, bytes)]
+        images = [pages[i] for i in ocr_indices]
+        size = _VISION_BATCH_SIZE
+        batches = [images[i:i + size] for i in range(0, len(images), size)]
+        ocr_batch = partial(_ocr_batch_throttled, client=vision_client)
+        for i, page_text in zip(ocr_indices, _map_batches(ocr_batch, batches)):
+            pages[i] = page_text
+        text_pages = pages
     else:
         img_bytes = load_image_bytes(file_bytes)
         text_pages.append(ocr_image_with_vision_bytes(img_bytes, vision_client))
@@ -100,11 +505,24 @@ _INVOICE_RE = re.compile(
 )
 _AMOUNT_RE = re.compile(r"([0-9]{1,3}(?:[,\s][0-9]{3})*(?:\.[0-9]{2}))")
 _LINE_ITEM_PRICE_RE = re.compile(r"\b([0-9]+(?:\.[0-9]{2}))\b")
+_VENDOR_SKIP_RE = re.compile(r"invoice", re.IGNORECASE)
+_TOTAL_KEYWORDS_RE = re.compile(r"(total|amount due|balance due|grand total)", re.IGNORECASE)
+_SKIP_RE = re.compile(r"(invoice|subtotal|total|amount due|tax|date|bill to|ship to)", re.IGNORECASE)
+_QTY_RE = re.compile(r"\b(\d+)\b")
+
+
+def prepare_lines(text: str) -> List[str]:
+    """Split OCR text into stripped, non-empty lines (each line stripped once)."""
+    return [l for l in (raw.strip() for raw in text.splitlines()) if l]
 
 
-def extract_summary_fields(text: str) -> Dict[str, str]:
-    """Extract vendor (simple), invoice number, date, and total amount."""
-    lines = [l.strip() for l in text.splitlines() if l.strip()]
+def extract_summary_fields(text: str, lines: Optional[List[str]] = None) -> Dict[str, str]:
+    """
+    Extract vendor (simple), invoice number, date, and total amount.
+    Pass lines from prepare_lines() to reuse an existing split of text.
+    """
+    if lines is None:
+        lines = prepare_lines(text)
     vendor = ""
     invoice_no = ""
     invoice_date = ""
@@ -112,12 +530,16 @@ def extract_summary_fields(text: str) -> Dict[str, str]:
 
     # vendor: assume top non-empty line (but skip "invoice" words)
     for l in lines[:10]:
-        if not re.search(r"invoice", l, re.IGNORECASE):
+        if not _VENDOR_SKIP_RE.search(l):
             vendor = l
             break
     if not vendor and lines:
         vendor = lines[0]
 
+    # invoice number, date and amounts are scanned independently: their
+    # patterns overlap (e.g. "2 15.00" is both date- and amount-like), so a
+    # single fused scan would let one field swallow another's match
+
     # invoice number
     m = _INVOICE_RE.search(text)
     if m:
@@ -131,7 +553,7 @@ def extract_summary_fields(text: str) -> Dict[str, str]:
     # total: look for lines containing 'total' or 'amount due', else pick largest money-like value
     total_candidates = []
     for l in lines:
-        if re.search(r"(total|amount due|balance due|grand total)", l, re.IGNORECASE):
+        if _TOTAL_KEYWORDS_RE.search(l):
             mo = _AMOUNT_RE.search(l)
             if mo:
                 total_candidates.append(mo.group(1))
@@ -147,7 +569,7 @@ def extract_summary_fields(text: str) -> Dict[str, str]:
                     pass
             if nums:
                 total = f"{max(nums):.2f}"
-        if not total and 'all_amounts' in locals() and all_amounts:
+        if not total and all_amounts:
             total = all_amounts[-1]
     else:
         total = total_candidates[-1]
@@ -162,17 +584,19 @@ def extract_summary_fields(text: str) -> Dict[str, str]:
     }
 
 
-def extract_line_items(text: str) -> List[Dict[str, str]]:
+def extract_line_items(text: str, lines: Optional[List[str]] = None) -> List[Dict[str, str]]:
     """
     Very naive line-item extraction:
     - Finds lines that contain a price-like token and tries to split them into description and price.
     - Returns a list of dicts with keys: description, qty (if found), unit_price (if found), amount
+    Pass lines from prepare_lines() to reuse an existing split of text.
     """
     items = []
-    lines = [l.strip() for l in text.splitlines() if l.strip()]
+    if lines is None:
+        lines = prepare_lines(text)
     for l in lines:
         # Skip common header/footer lines that are unlikely to be items
-        if re.search(r"(invoice|subtotal|total|amount due|tax|date|bill to|ship to)", l, re.IGNORECASE):
+        if _SKIP_RE.search(l):
             continue
         prices = _LINE_ITEM_PRICE_RE.findall(l)
         if prices:
@@ -180,10 +604,11 @@ def extract_line_items(text: str) -> List[Dict[str, str]]:
             left = l.rsplit(amount, 1)[0].strip(" -\t")
             # attempt to find qty (single integer) in left
             qty = ""
-            mqty = re.search(r"\b(\d+)\b", left)
+            mqty = _QTY_RE.search(left)
             if mqty:
                 qty = mqty.group(1)
-                desc = left.replace(qty, "").strip()
+                # cut out just the matched qty rather than every occurrence of its digits
+                desc = (left[:mqty.start()].rstrip() + " " + left[mqty.end():].lstrip()).strip()
             else:
                 desc = left
             items.append({"description": desc, "qty": qty, "unit_price": "", "amount": amount})
@@ -0,0 +1,287 @@
+import io
+
+import fitz
+import pytest
+from google.api_core import exceptions as gexc
+from google.cloud import vision
+from PIL import Image
+from tenacity import wait_none
+
+import ocr_utils
+from ocr_utils import (
+    _page_zoom,
+    _pdf_subset,
+    extract_line_items,
+    extract_summary_fields,
+    load_image_bytes,
+    ocr_bytes,
+    ocr_images_with_vision_batch,
+    pdf_extract_or_render,
+    render_pdf_pages,
+)
+
+
+def test_summary_basic_invoice():
+    text = "ACME Corp\nInvoice No: INV-001\nDate: 12/05/2024\nWidget 2 10.00\nTotal 1,234.50\n"
+    assert extract_summary_fields(text) == {
+        "vendor": "ACME Corp",
+        "invoice_number": "INV-001",
+        "invoice_date": "12/05/2024",
+        "total": "1,234.50",
+    }
+
+
+def test_summary_date_after_bare_invoice_heading():
+    # "Invoice\s*" may span the newline; the date must still be found
+    text = "INVOICE\n2024-03-04\nWidget 5.00\nAmount Due 99.00"
+    summary = extract_summary_fields(text)
+    assert summary["invoice_date"] == "2024-03-04"
+    assert summary["total"] == "99.00"
+
+
+def test_summary_total_fallback_sees_date_like_amounts():
+    # "2 15.00" also looks like a date; the amount must still count
+    text = "ACME Corp\nWidget 2 15.00\nDate: 03/04/2024"
+    assert extract_summary_fields(text)["total"] == "15.00"
+
+
+def test_summary_total_fallback_with_qty_prefix():
+    assert extract_summary_fields("Shop\nPack of 12 2 30.00")["total"] == "30.00"
+
+
+def test_summary_empty_text():
+    assert extract_summary_fields("") == {"vendor": "", "invoice_number": "", "invoice_date": "", "total": ""}
+
+
+def test_line_items_qty_removed_by_span():
+    items = extract_line_items("Item 2 pack of 12 bolts 24.00\nTotal 24.00")
+    assert items == [{"description": "Item pack of 12 bolts", "qty": "2", "unit_price": "", "amount": "24.00"}]
+
+
+def _encode(fmt, size, **kwargs):
+    buf = io.BytesIO()
+    Image.new("RGB", size, (200, 10, 10)).save(buf, fmt, **kwargs)
+    return buf.getvalue()
+
+
+def test_load_image_bytes_passes_small_png_and_jpeg_through():
+    for fmt in ("PNG", "JPEG"):
+        raw = _encode(fmt, (800, 600))
+        assert load_image_bytes(memoryview(raw)) == raw
+
+
+def test_load_image_bytes_keeps_mpo_as_jpeg():
+    # multi-picture JPEG as written by phone cameras; Pillow calls it "MPO"
+    second = Image.new("RGB", (800, 600))
+    raw = _encode("MPO", (800, 600), save_all=True, append_images=[second])
+    assert Image.open(io.BytesIO(raw)).format == "MPO"
+    assert load_image_bytes(raw) == raw
+
+    big = _encode("MPO", (4000, 3000), save_all=True, append_images=[second])
+    out = Image.open(io.BytesIO(load_image_bytes(big)))
+    assert out.format == "JPEG"
+    assert max(out.size) == 2500
+
+
+def test_load_image_bytes_normalizes_other_formats_to_png():
+    out = Image.open(io.BytesIO(load_image_bytes(_encode("BMP", (100, 100)))))
+    assert out.format == "PNG"
+
+
+def _image_response(text="", code=0):
+    response = vision.AnnotateImageResponse(full_text_annotation=vision.TextAnnotation(text=text))
+    if code:
+        response.error.code = code
+        response.error.message = "error %d" % code
+    return response
+
+
+class _FakeImageClient:
+    """
+    Answers batch_annotate_images from a script: each call pops the next list
+    of (text, error code) pairs, one per image sent.
+    """
+
+    def __init__(self, *rounds):
+        self.rounds = list(rounds)
+        self.sent = []
+        self.text_detection_calls = 0
+
+    def batch_annotate_images(self, requests, retry=None, timeout=None):
+        self.sent.append([r.image.content for r in requests])
+        results = self.rounds.pop(0)
+        assert len(results) == len(requests)
+        return vision.BatchAnnotateImagesResponse(responses=[_image_response(t, c) for t, c in results])
+
+    def text_detection(self, image, retry=None, timeout=None):
+        self.text_detection_calls += 1
+        if image.content == b"unreadable":
+            return _image_response("", 3)
+        return _image_response("fallback")
+
+
+@pytest.fixture
+def no_retry_wait(monkeypatch):
+    monkeypatch.setattr(ocr_utils, "_vision_retry_wait", wait_none())
+
+
+def test_vision_batch_resends_only_transient_failures(no_retry_wait):
+    client = _FakeImageClient([("a", 0), ("", 8), ("c", 0)], [("b", 0)])
+    assert ocr_images_with_vision_batch([b"1", b"2", b"3"], client) == ["a", "b", "c"]
+    assert client.sent == [[b"1", b"2", b"3"], [b"2"]]
+    assert client.text_detection_calls == 0
+
+
+def test_vision_batch_raises_after_last_retry(no_retry_wait):
+    client = _FakeImageClient(*[[("", 8)]] * ocr_utils._VISION_ATTEMPTS)
+    with pytest.raises(gexc.ResourceExhausted):
+        ocr_images_with_vision_batch([b"1"], client)
+    assert len(client.sent) == ocr_utils._VISION_ATTEMPTS
+    assert client.text_detection_calls == 0
+
+
+def test_vision_batch_falls_back_on_permanent_error(no_retry_wait):
+    # INVALID_ARGUMENT isn't retried; the image goes to text_detection instead
+    client = _FakeImageClient([("a", 0), ("", 3)])
+    assert ocr_images_with_vision_batch([b"1", b"2"], client) == ["a", "fallback"]
+    assert len(client.sent) == 1
+    assert client.text_detection_calls == 1
+
+
+def test_vision_batch_raises_when_fallback_fails_too(no_retry_wait):
+    client = _FakeImageClient([("a", 0), ("", 3)])
+    with pytest.raises(gexc.InvalidArgument):
+        ocr_images_with_vision_batch([b"1", b"unreadable"], client)
+    assert client.text_detection_calls == 1
+
+
+# ---- PDF paths ----
+
+_BORN_DIGITAL_TEXT = "Born-digital page with a real text layer, long enough to skip OCR."
+
+
+def _make_pdf(kinds):
+    """
+    Build a PDF with one page per entry of kinds: "text" pages carry an
+    embedded text layer, "scan" pages only an image. Page i is 200 + i points
+    wide so tests can tell pages apart after they've been split out.
+    """
+    doc = fitz.open()
+    scan = _encode("PNG", (100, 100))
+    for i, kind in enumerate(kinds):
+        page = doc.new_page(width=200 + i, height=300)
+        if kind == "text":
+            page.insert_textbox(page.rect, _BORN_DIGITAL_TEXT)
+        else:
+            page.insert_image(page.rect, stream=scan)
+    out = doc.tobytes()
+    doc.close()
+    return out
+
+
+def _page_widths(pdf_bytes):
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        return [int(page.rect.width) for page in doc]
+
+
+class _FakeFileClient(_FakeImageClient):
+    """
+    Answers batch_annotate_files with "ocr <page>" for each page of the
+    uploaded sub-PDF (pages identified by width), failing pages listed in
+    bad_pages with INVALID_ARGUMENT. Rendered pages come back as "image".
+    """
+
+    def __init__(self, bad_pages=()):
+        super().__init__()
+        self.bad_pages = set(bad_pages)
+        self.files = []
+
+    def batch_annotate_files(self, requests, retry=None, timeout=None):
+        file_responses = []
+        for request in requests:
+            pages = [w - 200 for w in _page_widths(request.input_config.content)]
+            self.files.append(pages)
+            responses = [_image_response("", 3) if p in self.bad_pages else _image_response("ocr %d" % p) for p in pages]
+            file_responses.append(vision.AnnotateFileResponse(responses=responses))
+        return vision.BatchAnnotateFilesResponse(responses=file_responses)
+
+    def batch_annotate_images(self, requests, retry=None, timeout=None):
+        self.sent.append([r.image.content for r in requests])
+        return vision.BatchAnnotateImagesResponse(responses=[_image_response("image") for _ in requests])
+
+
+def test_pdf_subset_selects_pages_in_order():
+    pdf = _make_pdf(["scan"] * 4)
+    assert _page_widths(_pdf_subset(pdf, [3, 1])) == [203, 201]
+    # requesting every page returns the upload untouched
+    assert _pdf_subset(pdf, [0, 1, 2, 3]) == pdf
+
+
+def test_ocr_bytes_merges_text_and_scanned_pages_in_order():
+    kinds = ["text", "scan", "text"] + ["scan"] * 6
+    client = _FakeFileClient()
+    text = ocr_bytes(_make_pdf(kinds), "invoice.pdf", client)
+    expected = [
+        _BORN_DIGITAL_TEXT if kind == "text" else "ocr %d" % i for i, kind in enumerate(kinds)
+    ]
+    # the text layer wraps inside the narrow page; compare words, not line breaks
+    assert [" ".join(page.split()) for page in text.split("\n\n")] == expected
+    # scanned pages only, in chunks of _VISION_FILE_PAGE_LIMIT
+    assert sorted(client.files) == [[1, 3, 4, 5, 6], [7, 8]]
+    assert client.sent == []
+
+
+def test_ocr_bytes_renders_pages_vision_rejected_in_pdf():
+    client = _FakeFileClient(bad_pages={2})
+    text = ocr_bytes(_make_pdf(["scan"] * 3), "invoice.pdf", client)
+    assert text.split("\n\n") == ["ocr 0", "ocr 1", "image"]
+    assert len(client.sent) == 1 and len(client.sent[0]) == 1
+
+
+def test_render_pdf_pages_pool_matches_in_process(monkeypatch):
+    pdf = _make_pdf(["scan"] * 3)
+    in_process = render_pdf_pages(pdf, [2, 0])
+    monkeypatch.setattr(ocr_utils, "_POOL_RENDER_MIN_PAGES", 1)
+    monkeypatch.setattr(ocr_utils.os, "cpu_count", lambda: 2)
+    assert render_pdf_pages(pdf, [2, 0]) == in_process
+    # the pool really ran the job (a broken pool falls back to in-process)
+    assert ocr_utils._render_pool is not None
+    ocr_utils._discard_render_pool(ocr_utils._render_pool)
+    assert [Image.open(io.BytesIO(b)).format for b in in_process] == ["JPEG", "JPEG"]
+
+
+def test_pdf_extract_keeps_only_substantial_text_layers():
+    doc = fitz.open()
+    doc.new_page().insert_text((72, 72), _BORN_DIGITAL_TEXT)
+    doc.new_page().insert_text((72, 72), "Page 2 of 3")  # a stamp on a scan, not a text layer
+    doc.new_page()
+    pages = pdf_extract_or_render(doc.tobytes(), render=False)
+    assert len(_BORN_DIGITAL_TEXT) > ocr_utils._MIN_EMBEDDED_TEXT_CHARS
+    assert pages[0].strip() == _BORN_DIGITAL_TEXT
+    assert pages[1:] == [None, None]
+    # with rendering on, the pages without a text layer come back as JPEG bytes
+    rendered = pdf_extract_or_render(doc.tobytes())
+    assert rendered[0] == pages[0]
+    assert all(p.startswith(b"\xff\xd8\xff") for p in rendered[1:])
+
+
+def _zoom_for_scan(scan_px, rect=None):
+    doc = fitz.open()
+    page = doc.new_page(width=216, height=288)  # 3 x 4 inches
+    page.insert_image(rect or page.rect, stream=_encode("PNG", scan_px))
+    return _page_zoom(page, 200)
+
+
+def test_page_zoom_caps_at_scan_resolution():
+    # 450 x 600 px over 3 x 4 inches is a 150 dpi scan
+    assert _zoom_for_scan((450, 600)) == pytest.approx(150 / 72)
+    # a 300 dpi scan is rendered at the 200 dpi target
+    assert _zoom_for_scan((900, 1200)) == pytest.approx(200 / 72)
+    # very coarse scans never drop below _MIN_ZOOM
+    assert _zoom_for_scan((60, 80)) == ocr_utils._MIN_ZOOM
+
+
+def test_page_zoom_ignores_small_images():
+    # a logo covering a corner of the page says nothing about the page's resolution
+    assert _zoom_for_scan((20, 20), fitz.Rect(0, 0, 50, 50)) == pytest.approx(200 / 72)
+    assert _page_zoom(fitz.open().new_page(), 200) == pytest.approx(200 / 72)